@@ -0,0 +1,106 @@
+#
+# Fit a long capture on bin averages instead of every raw sample. The
+# capture is cut into bins and each bin is replaced by its mean voltage,
+# which is fitted by the model averaged over the bin with weights from the
+# number of samples in it. The noise is then taken, as in a fit to every
+# point, from the residuals of all the samples about the fitted curve, so
+# the parameters and their errors come out the same as the full fit while
+# the fitting itself only sees the bins.
+#
+#   popt, pcov = fitBinned(chargeDischarge, t, v, 300, p0 = p0, knots = [t_c, t_d])
+#
+# knots are times where the curve has a sharp corner (the switching times
+# in Week 4); the bins near them are made `factor` times narrower, down to
+# single samples by default, which a fast discharge like the 10K run needs.
+# verify = True also does the full fit and reports how far apart the two
+# are. binAverage gives the bin means and their standard errors on their
+# own, with the noise from the scatter about a straight line through each
+# bin.
+#
+
+import numpy as np
+from scipy.optimize import curve_fit
+
+def binEdges(x, bins, knots = (), width = None, factor = 10):
+    # start index of every bin: len(x) / bins samples per bin, or `factor`
+    # times fewer within `width` (default two bins) of any knot
+    n = len(x)
+    step = max(1, n // bins)
+    fine = max(1, step // factor)
+    if width is None:
+        width = 2 * step * (x[-1] - x[0]) / max(n - 1, 1)
+    near = np.zeros(n, dtype = bool)
+    for knot in knots:
+        near |= np.abs(x - knot) <= width
+
+    starts = []
+    i = 0
+    while i < n:
+        starts.append(i)
+        i = i + (fine if near[i] else step)
+    return np.array(starts)
+
+def _binStats(x, y, starts):
+    # counts, mean x, mean y and the residual sum of squares about a
+    # straight line through each bin
+    counts = np.diff(np.append(starts, len(x)))
+    xb = np.add.reduceat(x, starts) / counts
+    yb = np.add.reduceat(y, starts) / counts
+    dx = x - np.repeat(xb, counts)
+    dy = y - np.repeat(yb, counts)
+    sxx = np.add.reduceat(dx * dx, starts)
+    sxy = np.add.reduceat(dx * dy, starts)
+    syy = np.add.reduceat(dy * dy, starts)
+    slope = sxy / np.where(sxx > 0, sxx, 1)
+    return counts, xb, yb, syy - slope * sxy
+
+def binAverage(x, y, bins, knots = (), width = None, factor = 20):
+    # returns the mean x, mean y and standard error of the mean y of each bin
+    x = np.asarray(x, dtype = float)
+    y = np.asarray(y, dtype = float)
+    starts = binEdges(x, bins, knots, width, factor)
+    counts, xb, yb, rss = _binStats(x, y, starts)
+    # the noise is taken to be white and the same throughout, so it is
+    # estimated once from the scatter of every sample about a straight line
+    # through its bin, which leaves out the slope of the curve across a bin
+    noise = np.sum(rss) / max(np.sum(np.maximum(counts - 2, 0)), 1)
+    return xb, yb, np.sqrt(noise / counts)
+
+def _binModel(model, jac, lo, hi):
+    # the model averaged over each bin (Simpson's rule from its first to
+    # its last sample) rather than taken at the mean x, which is what the
+    # bin mean of a curved stretch of data really measures
+    X = np.concatenate([lo, (lo + hi) / 2, hi])
+    m = len(lo)
+    def average(values):
+        return (values[:m] + 4 * values[m:2 * m] + values[2 * m:]) / 6
+    def binned(x, *p):
+        return average(model(X, *p))
+    if jac is None:
+        return binned, None
+    return binned, lambda x, *p: average(jac(X, *p))
+
+def fitBinned(model, x, y, bins, p0 = None, jac = None, bounds = (-np.inf, np.inf),
+              knots = (), width = None, factor = 20, verify = False):
+    x = np.asarray(x, dtype = float)
+    y = np.asarray(y, dtype = float)
+    starts = binEdges(x, bins, knots, width, factor)
+    counts, xb, yb, rss = _binStats(x, y, starts)
+    binned, binnedJac = _binModel(model, jac, x[starts], x[starts + counts - 1])
+    popt, pcov = curve_fit(binned, xb, yb, p0 = p0, sigma = 1 / np.sqrt(counts),
+                           absolute_sigma = True, jac = binnedJac, bounds = bounds)
+    # as in a fit to every sample the noise comes from the residuals of all
+    # of them about the fitted curve, which includes noise slower than a bin
+    noise = np.sum((y - model(x, *popt))**2) / max(len(y) - len(popt), 1)
+    pcov = pcov * noise
+    if not verify:
+        return popt, pcov
+
+    # the same fit on every sample, as the week scripts do it
+    full, fullcov = curve_fit(model, x, y, p0 = p0, jac = jac, bounds = bounds)
+    err = np.sqrt(np.diag(pcov))
+    fullerr = np.sqrt(np.diag(fullcov))
+    report = {"popt": full, "pcov": fullcov, "points": len(xb),
+              "pull": (popt - full) / fullerr,       # difference in standard errors
+              "errorRatio": err / fullerr}
+    return popt, pcov, report
@@ -0,0 +1,44 @@
+#
+# Single exponential relaxation, e.g. the cooling of the thermistor:
+#   T(x) = T_A + (T_F - T_A) * exp(-x / tau_c)
+# with its analytic Jacobian and a starting point worked out from the data,
+# so curve_fit needs only a handful of iterations:
+#
+#   p0 = exponentialGuess(time, temperature)
+#   popt, pcov = curve_fit(exponentialFunction, time, temperature, p0 = p0, jac = exponentialJacobian)
+#
+
+import numpy as np
+
+def exponentialFunction(x, T_A, T_F, tau_c):
+    return T_A + (T_F - T_A) * np.exp((-x) / tau_c)
+
+def exponentialJacobian(x, T_A, T_F, tau_c):
+    e = np.exp((-np.asarray(x, dtype = float)) / tau_c)
+    jac = np.empty((len(e), 3))
+    jac[:, 0] = 1 - e
+    jac[:, 1] = e
+    jac[:, 2] = (T_F - T_A) * e * x / tau_c**2
+    return jac
+
+def exponentialGuess(x, y, ends = 0.05, early = 0.3):
+    # T_F and T_A from averages over the first and last `ends` of the points,
+    # then tau_c (and T_F at x = 0) from a straight line fit of log|y - T_A|
+    # against x over the early points, those still more than `early` of the
+    # way from T_A to T_F.
+    x = np.asarray(x, dtype = float)
+    y = np.asarray(y, dtype = float)
+    k = max(1, int(len(y) * ends))
+    T_F = np.mean(y[:k])
+    T_A = np.mean(y[-k:])
+    tau_c = (x[-1] - x[0]) / 3.
+
+    sign = np.sign(T_F - T_A)
+    gap = (y - T_A) * sign
+    use = gap > early * abs(T_F - T_A)
+    if np.count_nonzero(use) >= 2:
+        slope, intercept = np.polyfit(x[use], np.log(gap[use]), 1)
+        if slope < 0:
+            tau_c = -1 / slope
+            T_F = T_A + sign * np.exp(intercept)
+    return [float(T_A), float(T_F), float(tau_c)]
@@ -0,0 +1,162 @@
+#
+# Remember curve_fit results on disk, so running a script again returns an
+# unchanged fit straight away and only refits when the data or the model
+# has changed:
+#
+#   cache = FitCache("fit_cache")
+#   popt, pcov = cache.curve_fit(chargeDischarge, t, v, p0 = p0, jac = chargeDischargeJacobian)
+#
+# A result is found by a hash of the data (x, y and sigma), p0, bounds, the
+# other curve_fit arguments and the model. The model is identified by its
+# name, compiled code, default arguments, captured variables and the
+# module constants it reads, so editing any of them gives a new key; pass
+# version = ... when a function it calls has changed instead. Once the
+# cache grows past maxbytes the least recently used results are removed.
+# hits and misses count lookups.
+#
+
+import hashlib
+import inspect
+import os
+import numpy as np
+from scipy.optimize import curve_fit
+
+def _hashCode(h, code):
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            _hashCode(h, const)
+        else:
+            h.update(repr(const).encode())
+
+def _globalNames(code):
+    # every name the code and the functions defined inside it look up
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            names |= _globalNames(const)
+    return names
+
+def _hashValue(h, value, seen = None):
+    if callable(value):
+        seen = set() if seen is None else seen
+        if id(value) in seen:   # a closure that refers to itself
+            h.update(b'<recursive>')
+            return
+        seen.add(id(value))
+        h.update(((getattr(value, '__module__', None) or '') + '.' + getattr(value, '__qualname__', repr(value))).encode())
+        code = getattr(value, '__code__', None)
+        if code is not None:
+            _hashCode(h, code)
+            # default arguments and captured variables change the model too
+            _hashValue(h, value.__defaults__, seen)
+            _hashValue(h, sorted((value.__kwdefaults__ or {}).items()), seen)
+            for cell in value.__closure__ or ():
+                try:
+                    _hashValue(h, cell.cell_contents, seen)
+                except ValueError:   # a cell not filled in yet
+                    h.update(b'<empty>')
+            # and so do module constants it reads, such as resistanceR; the
+            # modules and functions it calls are left to version = ...
+            module = getattr(value, '__globals__', {})
+            for name in sorted(_globalNames(code)):
+                if name in module:
+                    v = module[name]
+                    if not (callable(v) or inspect.ismodule(v)):
+                        h.update(name.encode())
+                        _hashValue(h, v, seen)
+        return
+    if isinstance(value, (list, tuple)):
+        # numbers, lists of numbers and arrays hash alike, so p0 = [1.0]
+        # and p0 = np.array([1.0]) find the same fit
+        try:
+            a = np.asarray(value)
+        except ValueError:   # ragged
+            a = None
+        if a is None or a.dtype.kind not in 'iuf':
+            h.update(b'(')
+            for v in value:
+                _hashValue(h, v, seen)
+            h.update(b')')
+            return
+        value = a
+    if value is None or isinstance(value, (str, bytes, bool, np.bool_)):
+        h.update(repr(value).encode())
+        return
+    a = np.asarray(value)
+    if a.dtype.kind in 'iuf':
+        a = a.astype(float)
+    if a.dtype.kind == 'O':
+        h.update(repr(value).encode())
+        return
+    a = np.ascontiguousarray(a)
+    h.update(str((a.dtype.str, a.shape)).encode())
+    h.update(a.tobytes())
+
+class FitCache:
+
+    __slots__ = ('directory', 'maxbytes', 'hits', 'misses')
+
+    def __init__(self, directory = "fit_cache", maxbytes = 2**28):
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok = True)
+
+    def key(self, model, xdata, ydata, version = None, **kwargs):
+        h = hashlib.blake2b(digest_size = 20)
+        for value in [model, version, xdata, ydata]:
+            _hashValue(h, value)
+        for name in sorted(kwargs):
+            h.update(name.encode())
+            _hashValue(h, kwargs[name])
+        return h.hexdigest()
+
+    def curve_fit(self, model, xdata, ydata, version = None, **kwargs):
+        # same arguments and return values as scipy's curve_fit; with
+        # full_output = True the infodict only holds nfev
+        full = kwargs.pop('full_output', False)
+        path = os.path.join(self.directory, self.key(model, xdata, ydata, version, **kwargs) + ".npz")
+        try:
+            with np.load(path) as z:
+                popt, pcov, nfev, mesg, ier = z["popt"], z["pcov"], int(z["nfev"]), str(z["mesg"]), int(z["ier"])
+        except (OSError, ValueError, KeyError):   # not there yet, or a half written file
+            self.misses += 1
+            popt, pcov, info, mesg, ier = curve_fit(model, xdata, ydata, full_output = True, **kwargs)
+            nfev = info["nfev"]
+            tmp = path + "." + str(os.getpid()) + ".tmp"
+            with open(tmp, 'wb') as f:
+                np.savez(f, popt = popt, pcov = pcov, nfev = nfev, mesg = mesg, ier = ier)
+            os.replace(tmp, path)
+            self.evict()
+        else:
+            self.hits += 1
+            os.utime(path)
+        if full:
+            return popt, pcov, {"nfev": nfev}, mesg, ier
+        return popt, pcov
+
+    def evict(self):
+        # remove least recently used results until the cache fits in maxbytes
+        entries = []
+        for e in os.scandir(self.directory):
+            if e.name.endswith(".npz"):
+                st = e.stat()
+                entries.append((st.st_mtime, st.st_size, e.path))
+        entries.sort()
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= self.maxbytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:   # removed by another process
+                pass
+            total -= size
+
+    def clear(self):
+        for e in os.scandir(self.directory):
+            if e.name.endswith(".npz"):
+                os.remove(e.path)
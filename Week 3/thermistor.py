@@ -0,0 +1,82 @@
+#
+# Thermistor resistance and temperature from the voltage divider used in
+# Week 3, written to work in place so a long two channel log is converted
+# without a pile of full size temporaries:
+#
+#   T = thermistorTemperature(y1, y2, resistanceR, internalResistance, B)
+#
+# For Tenma captures the conversion can be done straight from the ADC
+# codes: the scope only gives 256 codes per channel, so every pair is
+# tabulated once and the log is converted with a single lookup:
+#
+#   capture = tenmaopen("week3_3.sav")
+#   T = tenmaTemperature(capture, resistanceR, internalResistance)
+#
+
+import numpy as np
+
+def dividerResistance(y1, y2, resistanceR, internalResistance, out = None):
+    # thermistor above resistanceR, which is loaded by the scope input;
+    # y1 is across both and y2 across resistanceR
+    Rlower = (resistanceR * internalResistance) / (resistanceR + internalResistance)
+    out = np.subtract(y1, y2, out = out)
+    np.divide(out, y2, out = out)
+    np.multiply(out, Rlower, out = out)
+    return out
+
+def bParameterTemperature(R, R0, B, T0 = 298.2, out = None):
+    # 1 / T = 1 / T0 + ln(R / R0) / B
+    out = np.divide(R, R0, out = out)
+    np.log(out, out = out)
+    np.divide(out, B, out = out)
+    np.add(out, 1 / T0, out = out)
+    np.reciprocal(out, out = out)
+    return out
+
+def steinhartHartTemperature(R, A, B, C, out = None):
+    # 1 / T = A + B ln(R) + C ln(R)^3
+    out = np.log(R, out = out)
+    scratch = np.multiply(out, out)
+    np.multiply(scratch, C, out = scratch)
+    np.add(scratch, B, out = scratch)
+    np.multiply(out, scratch, out = out)
+    np.add(out, A, out = out)
+    np.reciprocal(out, out = out)
+    return out
+
+def thermistorTemperature(y1, y2, resistanceR, internalResistance, B, T0 = 298.2, out = None):
+    # the B parameter conversion done by week3.py, in one output array
+    out = dividerResistance(y1, y2, resistanceR, internalResistance, out = out)
+    return bParameterTemperature(out, resistanceR, B, T0, out = out)
+
+def codeTable(ch1, ch2, resistanceR, internalResistance, model, codes = 256):
+    # temperature for every pair of raw codes, table[code1, code2]; model
+    # turns an array of resistances into kelvin
+    v1 = ch1.scale(np.arange(codes))
+    v2 = ch2.scale(np.arange(codes))
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        R = dividerResistance(v1[:, None], v2[None, :], resistanceR, internalResistance)
+        return model(R)
+
+def tenmaTemperature(capture, resistanceR, internalResistance, B = 3977, T0 = 298.2, model = None):
+    # Samples where either channel is invalid (65535) are dropped, as
+    # tenmaread does. model defaults to the B parameter equation. Codes
+    # above 255 are valid but would make the table huge, so then the
+    # samples are converted one by one instead.
+    if model is None:
+        model = lambda R: bParameterTemperature(R, resistanceR, B, T0, out = R)
+    ch1 = capture["CH1"]
+    ch2 = capture["CH2"]
+    raw1 = ch1.raw
+    raw2 = ch2.raw
+    keep = (raw1 != 65535) & (raw2 != 65535)
+    if not keep.all():
+        raw1 = raw1[keep]
+        raw2 = raw2[keep]
+    if len(raw1) == 0:
+        return np.zeros(0)
+    codes = int(max(raw1.max(), raw2.max())) + 1
+    if codes <= 256:
+        return codeTable(ch1, ch2, resistanceR, internalResistance, model, codes)[raw1, raw2]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return model(dividerResistance(ch1.scale(raw1), ch2.scale(raw2), resistanceR, internalResistance))
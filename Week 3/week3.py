@@ -2,6 +2,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 from physlab import tenmaread
 from scipy.optimize import curve_fit 
+from cooling import exponentialFunction, exponentialJacobian, exponentialGuess
+from thermistor import thermistorTemperature
 
 resistanceR = 10000
 B = 3977
@@ -12,11 +14,7 @@ filename = "week3_3.sav"
 x1, y1, x2, y2 = tenmaread(filename)
 
 def getTemperature(resistanceR, internalResistance, y1, y2, B):
-    Rlower = (resistanceR * internalResistance) / (resistanceR + internalResistance)
-    resistanceThermister = ((y1 - y2) / y2) * Rlower
-    temperature = 1 / 298.2 + np.log(resistanceThermister / resistanceR) / B
-    temperature = 1 / temperature
-    return temperature
+    return thermistorTemperature(y1, y2, resistanceR, internalResistance, B, 298.2)
 
 def getcoolingTemperature(temperatureR, temperatureF, ):
     return false
@@ -24,12 +22,10 @@ def getcoolingTemperature(temperatureR, temperatureF, ):
 time = x2
 v = y2
 
-def exponentialFunction(x, T_A, T_F, tau_c):
- return T_A + (T_F - T_A) * np.exp((-x) / tau_c)
-
 temperatureF = getTemperature(resistanceR, internalResistance, y1, y2, B)
 
-popt, pcov = curve_fit(exponentialFunction, time, temperatureF)
+p0 = exponentialGuess(time, temperatureF)
+popt, pcov = curve_fit(exponentialFunction, time, temperatureF, p0 = p0, jac = exponentialJacobian)
 yfit = exponentialFunction(time, *popt)
 plt.xlabel("Time (s)")
 plt.ylabel("Temperature (K)")
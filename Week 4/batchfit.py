@@ -0,0 +1,159 @@
+#
+# Fit the same model to a whole series of captures at once, one capture per
+# worker process, e.g. the 10K, 100K, 1M and 10M resistor runs:
+#
+#   rows = fitCaptures(["10k.sav", "100k.sav", "1M.sav", "10M.sav"],
+#                      chargeDischarge, chargeDischargeGuess, jac = chargeDischargeJacobian)
+#   print(formatTable(rows, ["tau_C", "tau_D", "Vs", "t_C", "t_D"]))
+#
+# A capture is a .sav file name (channel 2 is fitted, as in week4.py) or a
+# (t, v) pair of arrays. p0 is either a list or a function p0(t, v) giving
+# the starting point for each capture. With processes the model, jac and
+# p0 have to be plain module level functions so they can be sent to the
+# workers.
+#
+
+import time
+import numpy as np
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from scipy.optimize import curve_fit
+from scipy.stats import qmc
+from physlab import tenmaread
+
+def _loadCapture(capture, channel):
+    if isinstance(capture, str):
+        x1, y1, x2, y2 = tenmaread(capture)
+        return (x1, y1) if channel == 1 else (x2, y2)
+    return capture
+
+def _fitOne(capture, model, p0, jac, bounds, channel):
+    row = {"capture": capture if isinstance(capture, str) else None,
+           "popt": None, "perr": None, "pcov": None, "nfev": 0, "time": 0., "error": None}
+    start = time.perf_counter()
+    try:
+        t, v = _loadCapture(capture, channel)
+        guess = p0(t, v) if callable(p0) else p0
+        popt, pcov, info, mesg, ier = curve_fit(model, t, v, p0 = guess, jac = jac,
+                                               bounds = bounds, full_output = True)
+    except Exception as e:   # handed back in the table instead of stopping the batch
+        row["error"] = e
+    else:
+        row["popt"] = popt
+        row["pcov"] = pcov
+        row["perr"] = np.sqrt(np.diag(pcov))
+        row["nfev"] = info["nfev"]
+    row["time"] = time.perf_counter() - start
+    return row
+
+def fitCaptures(captures, model, p0 = None, jac = None, bounds = (-np.inf, np.inf),
+                channel = 2, workers = None, processes = True):
+    captures = list(captures)
+    n = len(captures)
+    args = (captures, [model] * n, [p0] * n, [jac] * n, [bounds] * n, [channel] * n)
+    if not processes:
+        return list(map(_fitOne, *args))
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        return list(pool.map(_fitOne, *args))
+
+def formatTable(rows, names):
+    # one line per capture: value +/- error for each parameter, nfev and time
+    lines = ["\t".join(["capture"] + names + ["nfev", "time (s)"])]
+    for i, row in enumerate(rows):
+        name = row["capture"] if row["capture"] is not None else str(i)
+        if row["error"] is not None:
+            lines.append(name + "\tfailed: " + repr(row["error"]))
+            continue
+        values = ["%g +/- %g" % (p, e) for p, e in zip(row["popt"], row["perr"])]
+        lines.append("\t".join([name] + values + [str(row["nfev"]), "%.3f" % row["time"]]))
+    return "\n".join(lines)
+
+#
+# Multi-start fitting: the same capture fitted from many starting points
+# spread through the bounds by Latin hypercube sampling, several at once.
+# Once `agree` fits have landed on the best optimum found so far the
+# starts still waiting are cancelled ("skipped") and the fits already
+# running are left to finish without being waited for ("abandoned").
+#
+#   lower, upper = chargeDischargeBounds(t, v)
+#   result = multiStart(chargeDischarge, t, v, lower, upper, jac = chargeDischargeJacobian)
+#   popt, pcov = result["popt"], result["pcov"]
+#
+
+_data = None
+
+def _setData(model, t, v, jac, lower, upper):
+    global _data
+    _data = (model, t, v, jac, lower, upper)
+
+def _fitFrom(start):
+    model, t, v, jac, lower, upper = _data
+    row = {"start": start, "popt": None, "pcov": None, "cost": np.inf, "nfev": 0, "error": None}
+    try:
+        popt, pcov, info, mesg, ier = curve_fit(model, t, v, p0 = start, jac = jac,
+                                               bounds = (lower, upper), full_output = True)
+    except Exception as e:   # a start that fails just does not count
+        row["error"] = e
+    else:
+        row["popt"] = popt
+        row["pcov"] = pcov
+        row["cost"] = float(np.sum((model(t, *popt) - v)**2))
+        row["nfev"] = info["nfev"]
+    return row
+
+def _sameOptimum(a, b, rtol):
+    return (abs(a["cost"] - b["cost"]) <= rtol * abs(b["cost"]) and
+            np.allclose(a["popt"], b["popt"], rtol = np.sqrt(rtol), atol = 0))
+
+def _basins(rows, rtol):
+    # group the finished fits into distinct optima, best first
+    basins = []
+    for row in sorted((r for r in rows if r["popt"] is not None), key = lambda r: r["cost"]):
+        for basin in basins:
+            if _sameOptimum(row, basin, rtol):
+                basin["count"] += 1
+                break
+        else:
+            basins.append({"popt": row["popt"], "cost": row["cost"], "count": 1})
+    return basins
+
+def multiStart(model, t, v, lower, upper, starts = 32, jac = None, agree = 3,
+               rtol = 1e-6, workers = None, processes = True, seed = None):
+    lower = np.asarray(lower, dtype = float)
+    upper = np.asarray(upper, dtype = float)
+    sample = qmc.LatinHypercube(d = len(lower), seed = seed).random(starts)
+    points = list(qmc.scale(sample, lower, upper))
+
+    rows = []
+    def done(row):
+        rows.append(row)
+        best = min(rows, key = lambda r: r["cost"])
+        if best["popt"] is None:
+            return False
+        return sum(1 for r in rows if r["popt"] is not None and _sameOptimum(r, best, rtol)) >= agree
+
+    abandoned = 0
+    if not processes:
+        _setData(model, t, v, jac, lower, upper)
+        for start in points:
+            if done(_fitFrom(start)):
+                break
+    else:
+        pool = ProcessPoolExecutor(max_workers = workers, initializer = _setData,
+                                   initargs = (model, t, v, jac, lower, upper))
+        try:
+            pending = set(pool.submit(_fitFrom, start) for start in points)
+            while pending:
+                finished, pending = wait(pending, return_when = FIRST_COMPLETED)
+                if any([done(f.result()) for f in finished]):
+                    # fits already running are left to finish in the
+                    # background rather than waited for
+                    abandoned = sum(1 for f in pending if not f.cancel())
+                    break
+        finally:
+            pool.shutdown(wait = False, cancel_futures = True)
+
+    basins = _basins(rows, rtol)
+    best = min(rows, key = lambda r: r["cost"])
+    return {"popt": best["popt"], "pcov": best["pcov"], "cost": best["cost"],
+            "fits": rows, "basins": basins, "skipped": starts - len(rows) - abandoned,
+            "abandoned": abandoned}
@@ -0,0 +1,63 @@
+#
+# Charging and discharging of the capacitor in the photocurrent circuit,
+# vectorised for curve_fit, with its analytic Jacobian.
+#
+#   popt, pcov = curve_fit(chargeDischarge, t, v, p0 = p0, jac = chargeDischargeJacobian)
+#
+# Parameters are (tau_c, tau_d, v_s, t_c, t_d):
+#   x <= t_c          0
+#   t_c < x < t_d     v_s * (1 - exp(-(x - t_c) / tau_c))
+#   otherwise         v_c * exp(-(x - t_d) / tau_d)
+# where v_c = v_s * (1 - exp(-(t_d - t_c) / tau_c)) is the voltage reached
+# when the light is switched off.
+#
+
+import numpy as np
+
+def _regions(x, t_c, t_d):
+    x = np.asarray(x, dtype = float)
+    charging = (x > t_c) & (x < t_d)
+    discharging = (x > t_c) & ~charging
+    return x, charging, discharging
+
+def chargeDischarge(x, tau_c, tau_d, v_s, t_c, t_d):
+    x, charging, discharging = _regions(x, t_c, t_d)
+    out = np.zeros(len(x))
+    v_c = v_s * (1 - np.exp(-(t_d - t_c) / tau_c))
+    out[charging] = v_s * (1 - np.exp(-(x[charging] - t_c) / tau_c))
+    out[discharging] = v_c * np.exp(-(x[discharging] - t_d) / tau_d)
+    return out
+
+def chargeDischargeJacobian(x, tau_c, tau_d, v_s, t_c, t_d):
+    x, charging, discharging = _regions(x, t_c, t_d)
+    jac = np.zeros((len(x), 5))
+
+    # charging: v_s * (1 - e)
+    dt = x[charging] - t_c
+    e = np.exp(-dt / tau_c)
+    jac[charging, 0] = -v_s * e * dt / tau_c**2
+    jac[charging, 2] = 1 - e
+    jac[charging, 3] = -v_s * e / tau_c
+
+    # discharging: v_s * (1 - E) * D
+    E = np.exp(-(t_d - t_c) / tau_c)
+    v_c = v_s * (1 - E)
+    dt = x[discharging] - t_d
+    D = np.exp(-dt / tau_d)
+    jac[discharging, 0] = -v_s * E * (t_d - t_c) / tau_c**2 * D
+    jac[discharging, 1] = v_c * D * dt / tau_d**2
+    jac[discharging, 2] = (1 - E) * D
+    jac[discharging, 3] = -v_s * E / tau_c * D
+    jac[discharging, 4] = (v_s * E / tau_c + v_c / tau_d) * D
+    return jac
+
+def chargeDischargeGuess(x, y):
+    # the starting point used for the Week 4 fits
+    return [0.001, 0.001, np.max(y), 0.001, 0.002]
+
+def chargeDischargeBounds(x, y):
+    # bounds for multi-start fits: time constants up to the length of the
+    # capture, switching times within it and v_s up to twice the peak
+    span = x[-1] - x[0]
+    return ([span * 1e-6, span * 1e-6, 0., x[0], x[0]],
+            [span, span, 2 * np.max(y), x[-1], x[-1]])
@@ -0,0 +1,220 @@
+#
+# Straight line and low order polynomial least squares without keeping the
+# data. A PolyAccumulator holds only the (deg + 2) x (deg + 2) triangular
+# factor of the weighted design matrix with y appended, so points can be
+# added one at a time or in blocks, and accumulators built from different
+# files or processes can be merged. fit() gives the same coefficients and
+# covariance as np.polyfit(x, y, deg, w = w, cov = True).
+#
+#   acc = PolyAccumulator(1)
+#   for block in blocks:
+#       acc.add(block[:, 0], block[:, 1])
+#   a, cov = acc.fit()
+#
+
+import numpy as np
+from scipy.linalg import solve_triangular
+from scipy.special import comb
+
+class PolyAccumulator:
+
+    __slots__ = ('deg', 'n', 'R')
+
+    def __init__(self, deg = 1):
+        self.deg = deg
+        self.n = 0
+        self.R = np.zeros((0, deg + 2))
+
+    def _reduce(self, rows):
+        # QR of the stacked rows keeps R'R (and so the normal equations and
+        # the residual sum of squares) unchanged
+        self.R = np.linalg.qr(np.vstack([self.R, rows]), mode = 'r')
+
+    def add(self, x, y, w = None):
+        x = np.atleast_1d(np.asarray(x, dtype = float))
+        y = np.atleast_1d(np.asarray(y, dtype = float))
+        rows = np.empty((len(x), self.deg + 2))
+        rows[:, :-1] = np.vander(x, self.deg + 1)
+        rows[:, -1] = y
+        if w is not None:
+            rows *= np.atleast_1d(np.asarray(w, dtype = float))[:, None]
+        self._reduce(rows)
+        self.n += len(x)
+        return self
+
+    def merge(self, other):
+        if other.deg != self.deg:
+            raise ValueError("cannot merge fits of different degree")
+        self._reduce(other.R)
+        self.n += other.n
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def fit(self):
+        # coefficients, highest power first, and their covariance scaled by
+        # chi2 / (n - deg - 1), as np.polyfit does
+        order = self.deg + 1
+        if self.n <= order:
+            raise ValueError("the number of data points must exceed order to scale the covariance matrix")
+        R = self.R[:order, :order]
+        p = solve_triangular(R, self.R[:order, -1])
+        Rinv = solve_triangular(R, np.eye(order))
+        rss = self.R[order, -1]**2 if len(self.R) > order else 0.
+        cov = Rinv @ Rinv.T * (rss / (self.n - order))
+        return p, cov
+
+#
+# Bootstrap and Monte Carlo errors for polynomial fits. Every resampled
+# data set is fitted at once: the normal equations of all of them are
+# built as one stack and solved together instead of calling polyfit in a
+# loop. x is centred and scaled for the solve (the LED frequencies are
+# around 5e14 Hz) and the coefficients are turned back afterwards.
+#
+#   samples = bootstrapPolyfit(x, y, 1, 10000)
+#   low, mid, high = percentileInterval(q * samples[:, 0])     # h
+#
+
+def _fromScaled(deg, mu, s):
+    # matrix taking coefficients in u = (x - mu) / s to coefficients in x,
+    # both highest power first
+    P = np.polynomial.polynomial
+    T = np.zeros((deg + 1, deg + 1))
+    for k in range(deg + 1):
+        column = P.polypow([-mu / s, 1 / s], k)
+        T[:len(column), k] = column
+    return T[::-1, ::-1]
+
+def bootstrapPolyfit(x, y, deg = 1, n = 10000, w = None, method = "pairs", sigma = None, seed = None):
+    # method "pairs" resamples the (x, y) points, "residuals" adds resampled
+    # residuals of the fit to the fitted line, and "montecarlo" adds normal
+    # noise of standard deviation sigma (per point or one value) to y.
+    # Returns an (n, deg + 1) array of coefficients, highest power first;
+    # the odd resample whose points cannot fix the curve is left out.
+    x = np.asarray(x, dtype = float)
+    y = np.asarray(y, dtype = float)
+    w = np.ones(len(x)) if w is None else np.asarray(w, dtype = float)
+    rng = np.random.default_rng(seed)
+    m = len(x)
+
+    mu = np.mean(x)
+    s = np.std(x) if np.std(x) > 0 else 1.
+    A = np.vander((x - mu) / s, deg + 1)
+
+    if method == "pairs":
+        idx = rng.integers(0, m, (n, m))
+        X = A[idx] * w[idx][..., None]
+        Y = y[idx] * w[idx]
+    elif method == "residuals":
+        c = np.linalg.lstsq(A * w[:, None], y * w, rcond = None)[0]
+        fitted = A @ c
+        resid = y - fitted
+        X = np.broadcast_to(A * w[:, None], (n, m, deg + 1))
+        Y = (fitted + resid[rng.integers(0, m, (n, m))]) * w
+    elif method == "montecarlo":
+        if sigma is None:
+            raise ValueError("montecarlo needs sigma")
+        X = np.broadcast_to(A * w[:, None], (n, m, deg + 1))
+        Y = (y + rng.normal(0., 1., (n, m)) * sigma) * w
+    else:
+        raise ValueError("unknown method: " + str(method))
+
+    XtX = np.einsum('nmi,nmj->nij', X, X)
+    Xty = np.einsum('nmi,nm->ni', X, Y)
+    good = np.linalg.cond(XtX) < 1e12
+    coeffs = np.linalg.solve(XtX[good], Xty[good][..., None])[..., 0]
+    return coeffs @ _fromScaled(deg, mu, s).T
+
+def percentileInterval(values, level = 0.6827):
+    # (low, median, high) of the central `level` of the values, 1 sigma by default
+    tail = 50 * (1 - level)
+    low, mid, high = np.percentile(values, [tail, 50, 100 - tail])
+    return low, mid, high
+
+#
+# Many small weighted fits at once, e.g. one straight line per LED. The
+# data sets are packed end to end into single arrays with a count of
+# points for each, and every sum the fits need is taken over the segments
+# in one go, so there is no per-fit Python overhead. Each data set gives
+# the same as np.polyfit(x, y, deg, w = 1 / sigma, cov = True).
+#
+#   coeffs, covs = polyfitMany([(x1, y1), (x2, y2, sigma2), ...])
+#   coeffs, covs = polyfitSegments(x, y, counts, sigma = sigma)
+#
+
+def polyfitSegments(x, y, counts, deg = 1, sigma = None, absolute = False):
+    # x, y (and sigma) are the data sets one after another, counts the
+    # number of points in each. Returns coefficients (K, deg + 1), highest
+    # power first, and covariances (K, deg + 1, deg + 1). The covariance is
+    # scaled by chi2 / dof unless absolute = True (polyfit's cov = 'unscaled');
+    # a data set too small or degenerate to fit gives nan.
+    x = np.asarray(x, dtype = float)
+    y = np.asarray(y, dtype = float)
+    counts = np.asarray(counts, dtype = int)
+    K = len(counts)
+    order = deg + 1
+    w2 = np.ones(len(x)) if sigma is None else 1 / np.asarray(sigma, dtype = float)**2
+
+    seg = np.repeat(np.arange(K), counts)
+    n = np.maximum(counts, 1)
+    # centre and scale each data set so its normal equations are well conditioned
+    mu = np.bincount(seg, x, K) / n
+    s = np.sqrt(np.bincount(seg, (x - mu[seg])**2, K) / n)
+    s[s == 0] = 1.
+    u = (x - mu[seg]) / s[seg]
+
+    powers = np.empty((len(u), 2 * deg + 1))
+    powers[:, 0] = 1.
+    for j in range(1, 2 * deg + 1):
+        powers[:, j] = powers[:, j - 1] * u
+    moments = np.stack([np.bincount(seg, w2 * powers[:, j], K) for j in range(2 * deg + 1)], axis = 1)
+    rhs = np.stack([np.bincount(seg, w2 * y * powers[:, j], K) for j in range(order)], axis = 1)
+    i = np.arange(order)
+    XtX = moments[:, i[:, None] + i[None, :]]
+
+    # a data set with fewer distinct x than coefficients has a singular
+    # XtX; its determinant relative to the diagonal is then zero. Straight
+    # lines are by far the commonest case, their 2 x 2 inverse is written out.
+    if deg == 1:
+        det = moments[:, 0] * moments[:, 2] - moments[:, 1]**2
+    else:
+        det = np.linalg.det(XtX)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        ok = (counts > deg) & (det > 1e-12 * np.prod(moments[:, 2 * i], axis = 1))
+    c = np.full((K, order), np.nan)
+    inv = np.full((K, order, order), np.nan)
+    if deg == 1:
+        inv[ok, 0, 0] = moments[ok, 2] / det[ok]
+        inv[ok, 0, 1] = inv[ok, 1, 0] = -moments[ok, 1] / det[ok]
+        inv[ok, 1, 1] = moments[ok, 0] / det[ok]
+    else:
+        inv[ok] = np.linalg.inv(XtX[ok])
+    c[ok] = np.einsum('kij,kj->ki', inv[ok], rhs[ok])
+
+    if not absolute:
+        resid = y - np.einsum('ni,ni->n', c[seg], powers[:, :order])
+        dof = np.where(counts > order, counts - order, np.nan)
+        inv *= (np.bincount(seg, w2 * resid**2, K) / dof)[:, None, None]
+
+    # back from powers of u, lowest first, to powers of x, highest first:
+    # u^j = sum_i C(j, i) x^i (-mu)^(j - i) / s^j
+    j = np.arange(order)
+    C = np.where(i[:, None] <= j[None, :], comb(j[None, :], i[:, None]), 0.)
+    T = C * (-mu[:, None, None]) ** np.maximum(j[None, :] - i[:, None], 0) / s[:, None, None] ** j[None, :]
+    T = T[:, ::-1, :]
+    coeffs = np.einsum('kij,kj->ki', T, c)
+    covs = T @ inv @ T.transpose(0, 2, 1)
+    return coeffs, covs
+
+def polyfitMany(datasets, deg = 1, absolute = False):
+    # datasets is a list of (x, y) or (x, y, sigma)
+    datasets = list(datasets)
+    counts = [len(d[0]) for d in datasets]
+    x = np.concatenate([d[0] for d in datasets])
+    y = np.concatenate([d[1] for d in datasets])
+    sigma = None
+    if any(len(d) > 2 and d[2] is not None for d in datasets):
+        sigma = np.concatenate([d[2] if len(d) > 2 and d[2] is not None else np.ones(len(d[0]))
+                                for d in datasets])
+    return polyfitSegments(x, y, counts, deg, sigma, absolute)
@@ -1,18 +1,22 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from physlab import tenmaread
+from spectral import amplitudeSpectra, peakFrequency
+
+signals = [np.loadtxt("signal{0}.dat".format(i), unpack=True) for i in range(1, 7)]
+spectra = amplitudeSpectra([y for t, y in signals], [t[1]-t[0] for t, y in signals])
 
 for i in range(1, 7):
-    t, y = np.loadtxt("signal{0}.dat".format(i), unpack=True)
+    t, y = signals[i-1]
     y = y-np.mean(y)
-    ft= np.abs(np.fft.rfft(y))*2./len(y)
-    sample_rate = 1/(t[1]-t[0])
-    freqs = np.linspace(0.,sample_rate/2,len(ft))
+    freqs, ft = spectra[i-1]
 
     #freqs is an array of the frequencies (x values)
     #ft is an array of the (y values)
-    maxValue = freqs[np.where(ft == max(ft))]
-    print('Maximum value of sample {0} occurs at frequency: {1}Hz'.format(i, str(float(maxValue))))
+    #maxValue is the frequency of a sine fitted to the largest peak of ft, the
+    #error assumes that one sine in white noise is all there is
+    maxValue, amplitude, phase, error = peakFrequency(y, t[1]-t[0])
+    print('Maximum value of sample {0} occurs at frequency: {1:.2f} +/- {2:.2f}Hz'.format(i, maxValue, error))
     #Gets max value of freq.
 
     plt.subplot(2,1,1)
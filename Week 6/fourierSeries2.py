@@ -1,6 +1,7 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from physlab import tenmaread
+from spectral import peakFrequency
 
 t, y, x2, y2 = tenmaread('save1.sav')
 y = y-np.mean(y)
@@ -10,8 +11,10 @@ freqs = np.linspace(0.,sample_rate/2,len(ft))
 
 #freqs is an array of the frequencies (x values)
 #ft is an array of the (y values)
-maxValue = freqs[np.where(ft == max(ft))]
-print('Maximum value of sample occurs at frequency: {0}Hz'.format(str(float(maxValue))))
+#maxValue is the frequency of a sine fitted to the largest peak of ft, the
+#error assumes that one sine in white noise is all there is
+maxValue, amplitude, phase, error = peakFrequency(y, t[1]-t[0])
+print('Maximum value of sample occurs at frequency: {0:.2f} +/- {1:.2f}Hz'.format(maxValue, error))
 #Gets max value of freq.
 
 plt.subplot(2,1,1)
@@ -5,6 +5,195 @@
 #
 # January 2018: Modified to run under Python 3.
 #
+
+from struct import unpack_from, error
+import logging
+import numpy as np
+
+# The readers report each channel they decode on this logger, at INFO
+# unless told otherwise, so nothing is shown unless logging is set up:
+#   logging.basicConfig(level=logging.INFO)
+log=logging.getLogger("physlab")
+
+#
+# CHANNELS
+#
+# Both readers parse the file into Channel objects. A channel keeps the
+# raw ADC codes exactly as they are stored in the file (a read only view
+# on the memory map when the file is opened with mmap=True) and only
+# works out voltages and times for the slice of samples asked for.
+
+def _filebuffer(filename,mmap):
+  if mmap:
+    return(np.memmap(filename,dtype=np.uint8,mode='r'))
+  f=open(filename,'rb')
+  buf=f.read()
+  f.close()
+  return(buf)
+
+
+def _slotvalues(obj,skip):
+  values={}
+  for cls in reversed(type(obj).__mro__):
+    for name in getattr(cls,'__slots__',()):
+      if name not in skip and hasattr(obj,name):
+        values[name]=getattr(obj,name)
+  return(values)
+
+
+class Channel(object):
+
+  __slots__=('Name','raw')
+
+  def __len__(self):
+    return(len(self.raw))
+
+  def metadata(self):
+# The header fields as a dictionary
+    return(_slotvalues(self,('raw',)))
+
+  def _valid(self,raw):
+    return(None)
+
+  def scale(self,codes):
+# Volts for an array of raw ADC codes, e.g. to tabulate every code
+    return(self._volts(np.asarray(codes,dtype=np.float64)))
+
+  def volts(self,start=None,stop=None):
+    raw=self.raw[start:stop]
+    keep=self._valid(raw)
+    if keep is not None:
+      raw=raw[keep]
+    return(self._volts(raw.astype(np.float64)))
+
+  def times(self,start=None,stop=None):
+    start,stop,step=slice(start,stop).indices(len(self.raw))
+    index=np.arange(start,stop,step,dtype=np.float64)
+    keep=self._valid(self.raw[start:stop:step])
+    if keep is not None:
+      index=index[keep]
+    return(self._times(index))
+
+  def chunks(self,size=1<<20):
+# Yield (x, y) for consecutive blocks of size samples, so a channel far
+# longer than memory can be worked through from a memory mapped capture.
+    for start in range(0,len(self.raw),size):
+      yield(self.times(start,start+size),self.volts(start,start+size))
+
+  def stats(self,size=1<<20):
+# min, max, mean and rms of the voltage worked out block by block, plus
+# the number of samples used and the number dropped as invalid.
+    count=0
+    total=0.
+    squares=0.
+    lo=np.inf
+    hi=-np.inf
+    for start in range(0,len(self.raw),size):
+      y=self.volts(start,start+size)
+      if len(y)==0:
+        continue
+      count=count+len(y)
+      total=total+np.sum(y)
+      squares=squares+np.dot(y,y)
+      lo=min(lo,float(np.min(y)))
+      hi=max(hi,float(np.max(y)))
+    stats={"count":count,"dropped":len(self.raw)-count,"min":lo,"max":hi,
+           "mean":np.nan,"rms":np.nan}
+    if count:
+      stats["mean"]=float(total/count)
+      stats["rms"]=float(np.sqrt(squares/count))
+    return(stats)
+
+
+class Capture(object):
+# A whole capture: the main header fields and a dictionary of its channels.
+# capture["CH1"] gives a Channel. Channels that were off are simply not
+# there, no zeros are allocated for them until the capture is unpacked the
+# old way:  x1, y1, x2, y2 = capture
+
+  __slots__=('Model','channels')
+
+  def __getitem__(self,name):
+    return(self.channels[name])
+
+  def __contains__(self,name):
+    return(name in self.channels)
+
+  def __iter__(self):
+    return(iter(self.astuple()))
+
+  def metadata(self):
+# The header fields as a dictionary, "channels" holds one per channel
+    meta=_slotvalues(self,('channels',))
+    meta["channels"]={}
+    for name,ch in self.channels.items():
+      meta["channels"][name]=ch.metadata()
+    return(meta)
+
+  def astuple(self):
+# (x1, y1, x2, y2) as returned by tenmaread/owonread. A channel that is off
+# gets the time axis of the other one and zero volts.
+    ch1=self.channels.get("CH1")
+    ch2=self.channels.get("CH2")
+    if ch1 is None and ch2 is None:
+      return(np.zeros(1),np.zeros(1),np.zeros(1),np.zeros(1))
+    if ch1 is not None:
+      x1=ch1.times()
+      y1=ch1.volts()
+    if ch2 is not None:
+      x2=ch2.times()
+      y2=ch2.volts()
+    if ch1 is None:
+      x1=x2
+      y1=np.zeros(len(x2))
+    if ch2 is None:
+      x2=x1
+      y2=np.zeros(len(x1))
+    return(x1,y1,x2,y2)
+
+
+class OwonCapture(Capture):
+
+  __slots__=('FileLength',)
+
+
+class TenmaCapture(Capture):
+
+  __slots__=('Serial','Acquire','TriggerCoupling','TriggerEdge','TriggerLevel',
+             'Running')
+
+
+class OwonChannel(Channel):
+
+  __slots__=('BlockSize','NumSamples','Tdiv','ZeroLev','Vdiv','ProbeAttn',
+             'Freq','Period','mVperBit','TimePerDiv','TimePerDivStr',
+             'VoltPerDiv','VoltPerDivStr','SperSample')
+
+  def _volts(self,y):
+    return(y*self.mVperBit/1000*self.ProbeAttn)
+
+  def _times(self,x):
+    return(x*self.SperSample)
+
+
+class TenmaChannel(Channel):
+
+  __slots__=('Channel','Coupling','BWLimit','Probe','Invert','VoltZeroPoint',
+             'VoltPerDiv','HorPos','TimePerDiv','TimePerPoint','SampleLength',
+             'HorPosPoint')
+
+  def _valid(self,raw):
+    # 65535 is not a valid reading, those samples are dropped
+    return(raw!=65535)
+
+  def _volts(self,y):
+    y=y-self.VoltZeroPoint
+    return(y*self.VoltPerDiv/256/1E5)
+
+  def _times(self,x):
+    return(x*self.TimePerPoint/1E12)
+
+
 # OWON
 #
 # Inspired by and using parts from owonreader_01.zip by Fabio Eboli 
@@ -39,14 +228,16 @@
 # second trace (eventual):
 #   ... like first trace, change only abs. offsets
 
-def owonread(filename):
+# Every block has the same 51 byte header, so it is decoded with a single
+# unpack_from: channel string, then eleven 4-byte ints from 0x03 to 0x2B
+# (block size ... period) and the mV per bit float at 0x2F.
+OwonHeader='<3s11if'
+OwonHeaderSize=0x33
 
-  from struct import unpack
-  import numpy as np
-  import os
-  import sys
+def _owonparse(buf,samples=True):
+# Read every "CHx" block of an OWON bin file up to the EOF.
+# Returns an OwonCapture holding an OwonChannel per block
 
-  blocks=[]
   SeqT=[1,2.5,5,10,25,50,100,250,500]
   LabT=['nS','uS','mS','S']
   SeqTs=[0.000000001,0.000001,0.001,1]
@@ -55,174 +246,113 @@ def owonread(filename):
   SeqVv=[0.001,1]
   PrAttn=[1,10,100,1000]
 
-  f=open(filename,'rb')
-
-  DsoStr=f.read(6).decode("ascii")
-#  print(DsoStr)
+  DsoStr=bytes(buf[0:6]).decode("ascii")
   if DsoStr!="SPBV01": #Check dso model signature
-    print("wrong data file type")
-    f.close()
+    log.warning("wrong data file type")
     return(-1)
-  
-  BlockNumber=0
+
+  capture=OwonCapture()
+  capture.Model=DsoStr
+  capture.FileLength=unpack_from('<i',buf,0x06)[0]
+  capture.channels={}
   BlockStart=0x0A   #first "CHx" string
-  f.seek(BlockStart)
-  CHStr=f.read(3).decode("ascii")
-#  print(CHStr)
-  if CHStr=="CH1":# till the EOF
-    BlockNumber=BlockNumber+1
-    f.seek(BlockStart)
-    Channel=str(f.read(3).decode("ascii"))
-    f.seek(0x03+BlockStart)
-    BlockSize=unpack('i',f.read(4))[0] #block size 
-    if BlockSize<0:
-      BlockSize=-BlockSize
-    BlockSize=BlockSize+3  #including "CHx"
-    f.seek(0x0B+BlockStart)
-    NumSamples=unpack('i',f.read(4))[0] # Number of Collecting Points
-    f.seek(0x13+BlockStart)
-    Tdiv=unpack('i',f.read(4))[0]       # Time Per division
-    TimePerDivStr=str(SeqT[(Tdiv+2)%9])+LabT[(Tdiv+2)//9]+"/div"
-    TimePerDiv=float(SeqT[(Tdiv+2)%9])*(SeqTs[(Tdiv+2)//9]) #numeric format
-    ZeroLev=unpack('i',f.read(4))[0]        # zero voltage
-#    f.seek(0x1B+BlockStart)
-    Vdiv=unpack('i',f.read(4))[0]       # Voltage per division
-    VoltPerDivStr=str(SeqV[(Vdiv+1)%9])+LabV[(Vdiv+1)//9]+"/div"
-    VoltPerDiv=float(SeqV[(Vdiv+1)%9])*(SeqVv[(Vdiv+1)//9])
-    ProbeAttn=PrAttn[unpack('i',f.read(4))[0]]  # probe attenuation
-    f.seek(0x27+BlockStart)
-    Freq=unpack('i',f.read(4))[0]        # frequency
-#    f.seek(0x2B+BlockStart)
-    Period=unpack('i',f.read(4))[0]      # period
-    mVperBit=unpack('f',f.read(4))[0]      # Voltage multipier mV per LSB
-    SperSample=TimePerDiv/NumSamples*10
-#    f.seek(BlockStart+0x33)
-#    CHStr=f.read(2)
-    x1 = np.empty(NumSamples)
-    y1 = np.empty(NumSamples)
-    for i in range(NumSamples):
-      y1[i] = unpack('h',f.read(2))[0]*mVperBit/1000*ProbeAttn
-      x1[i] = SperSample*i
-    BlockStart=BlockStart+BlockSize
-    f.seek(BlockStart)
-#  print('-------Parameters-----------')
-#  print("Device code: ",DsoStr)
-#  print("---------Block ",BlockNumber,"----------")
-    print(Channel,":")
-#  print("Block start: ",BlockStart)
-#  print("Block Length: ",BlockSize)
-    print("Number of Samples: ",NumSamples)
-    print("Time per division: ",TimePerDivStr)
-    print("Volt per division: ",VoltPerDivStr)
-#  print("Frequency: ",Freq)
-#  print("Period: ",Period)
-#  print("mVperBit: ",mVperBit)
-#  print("Attenuation: ",ProbeAttn)
-  else:
-    print("CH1 is OFF")
-#    f.close()
-    x1 = np.zeros(1)
-    y1 = np.zeros(1)
-#    return(-1)
-
-  
-  f.seek(BlockStart)
-  CHStr=f.read(3).decode("ascii") 
-#  print CHStr
-  if CHStr=="CH2":# till the EOF
-    BlockNumber=BlockNumber+1
-    f.seek(BlockStart)
-    Channel=str(f.read(3).decode("ascii"))
-    f.seek(0x03+BlockStart)
-    BlockSize=unpack('i',f.read(4))[0] #block size 
+  while BlockStart+OwonHeaderSize<=len(buf):  # till the EOF
+    ch=OwonChannel()
+    (CHStr,BlockSize,WholeScreen,ch.NumSamples,SlowMoving,ch.Tdiv,ch.ZeroLev,
+     ch.Vdiv,Probe,Unknown,ch.Freq,ch.Period,ch.mVperBit)=unpack_from(OwonHeader,buf,BlockStart)
+    ch.Name=CHStr.decode("ascii")
+    if ch.Name[0:2]!="CH":
+      break
     if BlockSize<0:
       BlockSize=-BlockSize
-    BlockSize=BlockSize+3  #including "CHx"
-    f.seek(0x0B+BlockStart)
-    NumSamples=unpack('i',f.read(4))[0] # Number of Collecting Points
-    f.seek(0x13+BlockStart)
-    Tdiv=unpack('i',f.read(4))[0]       # Time Per division
-    TimePerDivStr=str(SeqT[(Tdiv+2)%9])+LabT[(Tdiv+2)//9]+"/div"
-    TimePerDiv=float(SeqT[(Tdiv+2)%9])*(SeqTs[(Tdiv+2)//9]) #numeric format
-    ZeroLev=unpack('i',f.read(4))[0]        # zero voltage
-#    f.seek(0x1B+BlockStart)
-    Vdiv=unpack('i',f.read(4))[0]       # Voltage per division
-    VoltPerDivStr=str(SeqV[(Vdiv+1)%9])+LabV[(Vdiv+1)//9]+"/div"
-    VoltPerDiv=float(SeqV[(Vdiv+1)%9])*(SeqVv[(Vdiv+1)//9])
-    ProbeAttn=PrAttn[unpack('i',f.read(4))[0]]  # probe attenuation
-    f.seek(0x27+BlockStart)
-    Freq=unpack('i',f.read(4))[0]        # frequency
-#    f.seek(0x2B+BlockStart)
-    Period=unpack('i',f.read(4))[0]      # period
-    mVperBit=unpack('f',f.read(4))[0]      # Voltage multipier mV per LSB
-    SperSample=TimePerDiv/NumSamples*10
-#    BlockStart=BlockStart+BlockSize
-#    f.seek(BlockStart)
-#    f.seek(BlockStart+0x33)
-#    CHStr=f.read(2)
-    x2 = np.empty(NumSamples)
-    y2 = np.empty(NumSamples)
-    for i in range(NumSamples):
-      y2[i] = unpack('h',f.read(2))[0]*mVperBit/1000*ProbeAttn
-      x2[i] = SperSample*i
-    f.close()
-#  print('-------Parameters-----------')
-#  print("Device code: ",DsoStr)
-#  print("---------Block ",BlockNumber,"----------")
-    print(Channel,":")
-#  print("Block start: ",BlockStart)
-#  print("Block Length: ",BlockSize)
-    print("Number of Samples: ",NumSamples)
-    print("Time per division: ",TimePerDivStr)
-    print("Volt per division: ",VoltPerDivStr)
-#  print("Frequency: ",Freq)
-#  print("Period: ",Period)
-#  print("mVperBit: ",mVperBit)
-#  print("Attenuation: ",ProbeAttn)
-  else:
-    print("CH2 is OFF")
-    x2 = np.zeros(1)
-    y2 = np.zeros(1)
-#    f.close()
-#    return(-1)
-
-  if (len(x1) == 1):
-   x1 = x2
-   y1 = np.zeros(len(x2))
-  if (len(x2) == 1):
-   x2 = x1
-   y2 = np.zeros(len(x1))
-  
-  return(x1,y1,x2,y2)
+    ch.BlockSize=BlockSize+3  #including "CHx"
+    Tdiv=ch.Tdiv
+    Vdiv=ch.Vdiv
+    ch.TimePerDivStr=str(SeqT[(Tdiv+2)%9])+LabT[(Tdiv+2)//9]+"/div"
+    ch.TimePerDiv=float(SeqT[(Tdiv+2)%9])*(SeqTs[(Tdiv+2)//9]) #numeric format
+    ch.VoltPerDivStr=str(SeqV[(Vdiv+1)%9])+LabV[(Vdiv+1)//9]+"/div"
+    ch.VoltPerDiv=float(SeqV[(Vdiv+1)%9])*(SeqVv[(Vdiv+1)//9])
+    ch.ProbeAttn=PrAttn[Probe]  # probe attenuation
+    ch.SperSample=ch.TimePerDiv/ch.NumSamples*10
+    if samples:
+      ch.raw=np.frombuffer(buf,dtype='<i2',count=ch.NumSamples,offset=BlockStart+OwonHeaderSize)
+    capture.channels[ch.Name]=ch
+    BlockStart=BlockStart+ch.BlockSize
+
+  return(capture)
+
+
+def _owonreport(ch,loglevel):
+  log.log(loglevel,"%s: Number of Samples: %d, Time per division: %s, Volt per division: %s",
+          ch.Name,ch.NumSamples,ch.TimePerDivStr,ch.VoltPerDivStr)
+#  print("Frequency: ",ch.Freq)
+#  print("Period: ",ch.Period)
+#  print("mVperBit: ",ch.mVperBit)
+#  print("Attenuation: ",ch.ProbeAttn)
+
+
+def owonopen(filename,mmap=True):
+# Open an OWON bin file without decoding the samples.
+# Returns an OwonCapture, see CHANNELS above.
+  return(_owonparse(_filebuffer(filename,mmap)))
+
+
+def owonheader(filename):
+# Parse only the SPBV01 block headers. The file is memory mapped and the
+# sample data is never touched, the channels of the capture have no raw
+# samples.
+  return(_owonparse(_filebuffer(filename,True),samples=False))
+
+
+def owonchunks(filename,channel="CH1",size=1<<20):
+# Yield (x, y) blocks of size samples of one channel of an OWON bin file
+  capture=owonopen(filename,mmap=True)
+  if capture==-1:
+    return
+  for chunk in capture[channel].chunks(size):
+    yield(chunk)
+
+
+def owonblocks(filename,loglevel=logging.INFO):
+# Read every "CHx" block of an OWON bin file up to the EOF.
+# Returns a dictionary of channel name ("CH1", "CH2", "CHA" ...) to (x, y)
+
+  capture=owonopen(filename,mmap=False)
+  if capture==-1:
+    return(-1)
 
+  blocks={}
+  for ch in capture.channels.values():
+    blocks[ch.Name]=(ch.times(),ch.volts())
+    _owonreport(ch,loglevel)
 
-#
-# TENMA
-#
+  return(blocks)
 
-def tenmaread(filename):
-  from struct import unpack
-  import numpy as np
-  import os
-  import sys
 
-  LabT=['nS','uS','mS','S']
-  LabV=['mV','V']
+def owonread(filename,metadata=False,loglevel=logging.INFO):
+# Returns (x1, y1, x2, y2), or (x1, y1, x2, y2, meta) with metadata=True
+# where meta is the dictionary of header values from Capture.metadata()
 
-  f=open(filename,'rb')
+  capture=owonopen(filename,mmap=False)
+  if capture==-1:
+    return(-1)
 
-  FileSize = os.path.getsize(filename)
-#  print "file size = ", FileSize
+  for ch in capture.channels.values():
+    _owonreport(ch,loglevel)
+  if "CH1" not in capture:
+    log.log(loglevel,"CH1 is OFF")
+  if "CH2" not in capture:
+    log.log(loglevel,"CH2 is OFF")
 
-#  data=np.zeros(FileSize)
-#  for i in range(FileSize):
-#    data[i] = unpack('B',f.read(1))[0]
+  if metadata:
+    return(capture.astuple()+(capture.metadata(),))
+  return(capture.astuple())
 
-  head=np.zeros(FileSize)
-#  f.seek(0)
 
-#  return(data)
-  
+#
+# TENMA
+#
+
 # MAIN HEADER 124 bytes
 # 
 # 0  170
@@ -260,23 +390,6 @@ def tenmaread(filename):
 # 98: 1 = RUN, 0 = STOP
 # 99-123: All 255 ?
 
-  f.seek(10)
-  DsoStr=f.read(7).decode("ascii")
-  if DsoStr!="72-8705": #Check dso model signature
-    print("wrong data file type")
-    f.close()
-    return(-1)
-  f.seek(0)
-
-  HeaderSize = 124
-  for i in range(HeaderSize):
-    j = f.tell()
-    byte = f.read(1)
-#    print j,i,unpack('c',byte)[0],unpack('B',byte)[0]
-    head[j] = unpack('B',byte)[0]
-
-  numChannels = head[97]
-
 # time base /div
 # 2ns, 5ns, 10ns, 20ns,50ns,100ns,200ns,500ns
 # 1us, 2us, 5us, 10us, 20us, 50us, 100us, 200us, 500us
@@ -307,155 +420,438 @@ def tenmaread(filename):
 # 51-54: 4-byte long: hpos offset point
 # 55-61: ? All 255 (Ch1)?  All 15 (Ch2)?
 
-#
-# Ch 1
-# header 62 bytes
-# data SampleLength*2 bytes
-  Channel = unpack('B',f.read(1))[0]
-  Coupling = unpack('B',f.read(1))[0]
-  BWLimit = unpack('B',f.read(1))[0]
-  f.seek(8,1)
-  Probe = unpack('B',f.read(1))[0]
-  Invert = unpack('B',f.read(1))[0]
-  VoltZeroPoint = unpack('<H',f.read(2))[0]
-  VoltPerDiv = unpack('<Q',f.read(8))[0]
-  HorPos = unpack('<q',f.read(8))[0]
-  TimePerDiv = unpack('<Q',f.read(8))[0]
-  TimePerPoint = unpack('<Q',f.read(8))[0]
-  SampleLength = unpack('<L',f.read(4))[0]
-  HorPosPoint = unpack('<L',f.read(4))[0]
-  f.seek(7,1)
-
-#  print(f.tell())
-
-#  print(Channel," ",Coupling," ",BWLimit," ",Probe," ",Invert)
-#  print(VoltZeroPoint," ",VoltPerDiv)
-#  print(HorPos)
-#  print(TimePerDiv," ",TimePerPoint)
-#  print(SampleLength," ",HorPosPoint)
-
-  print("Channel: ",Channel+1)
-  print("Number of Samples: ",SampleLength)
-  
+# Each channel is a 62 byte header followed by SampleLength*2 bytes of data
+
+# TRAILER (8 bytes)
+# all 15
+
+TenmaHeaderSize=124
+TenmaChannelHeader='<BBB8xBBHQqQQLL7x'
+TenmaChannelHeaderSize=62
+
+def _tenmaparse(buf,samples=True):
+# Returns a TenmaCapture holding a TenmaChannel per channel that was on
+
+  DsoStr=bytes(buf[10:17]).decode("ascii")
+  if DsoStr!="72-8705": #Check dso model signature
+    log.warning("wrong data file type")
+    return(-1)
+
+  capture=TenmaCapture()
+  capture.Model=DsoStr
+  capture.Serial=bytes(buf[20:30]).decode("ascii")
+  capture.Acquire=int(buf[60])
+  capture.TriggerCoupling=int(buf[73])
+  capture.TriggerEdge=int(buf[74])
+  capture.TriggerLevel=unpack_from('<q',buf,89)[0]
+  capture.Running=int(buf[98])
+  capture.channels={}
+
+  numChannels = int(buf[97])
+
+  BlockStart=TenmaHeaderSize
+  for i in range(2 if numChannels == 2 else 1):
+    ch=TenmaChannel()
+    (ch.Channel,ch.Coupling,ch.BWLimit,ch.Probe,ch.Invert,ch.VoltZeroPoint,
+     ch.VoltPerDiv,ch.HorPos,ch.TimePerDiv,ch.TimePerPoint,ch.SampleLength,
+     ch.HorPosPoint)=unpack_from(TenmaChannelHeader,buf,BlockStart)
+    ch.Name="CH"+str(ch.Channel+1)
+    if samples:
+      ch.raw=np.frombuffer(buf,dtype='<u2',count=ch.SampleLength,offset=BlockStart+TenmaChannelHeaderSize)
+    capture.channels[ch.Name]=ch
+    BlockStart=BlockStart+TenmaChannelHeaderSize+2*ch.SampleLength
+
+  return(capture)
+
+
+def _tenmareport(ch,loglevel):
+#  print(ch.Channel," ",ch.Coupling," ",ch.BWLimit," ",ch.Probe," ",ch.Invert)
+#  print(ch.VoltZeroPoint," ",ch.VoltPerDiv)
+#  print(ch.HorPos)
+#  print(ch.TimePerDiv," ",ch.TimePerPoint)
+#  print(ch.SampleLength," ",ch.HorPosPoint)
+
+  if not log.isEnabledFor(loglevel):
+    return
+
+  TimePerDiv=ch.TimePerDiv
+  VoltPerDiv=ch.VoltPerDiv
+
   if (TimePerDiv < 1e3):
-    print("Time per division: ",TimePerDiv," pS")
+    TimePerDivStr=str(TimePerDiv)+" pS"
   elif (TimePerDiv < 1e6):
-    print("Time per division: ",TimePerDiv/1e3," nS")
+    TimePerDivStr=str(TimePerDiv/1e3)+" nS"
   elif (TimePerDiv < 1e9):
-    print("Time per division: ",TimePerDiv/1e6," uS")
+    TimePerDivStr=str(TimePerDiv/1e6)+" uS"
   elif (TimePerDiv < 1e12):
-    print("Time per division: ",TimePerDiv/1e9," mS")
+    TimePerDivStr=str(TimePerDiv/1e9)+" mS"
   else:
-    print("Time per division: ",TimePerDiv/1e12, " S")
+    TimePerDivStr=str(TimePerDiv/1e12)+" S"
     
   if (VoltPerDiv < 1e3):
-    print("Volt per division: ",VoltPerDiv," uV")
+    VoltPerDivStr=str(VoltPerDiv)+" uV"
   elif (VoltPerDiv < 1e6):
-    print("Volt per division: ",VoltPerDiv/1e3," mV")
+    VoltPerDivStr=str(VoltPerDiv/1e3)+" mV"
   else:
-    print("Volt per division: ",VoltPerDiv/1e6," V")
-
-  x1 = np.empty(SampleLength)
-  y1 = np.empty(SampleLength)
-  j = 0
-  for i in range(SampleLength):
-    value = unpack('<H',f.read(2))[0]
-    if (value != 65535):
-      y1[j] = value
-      x1[j] = i*1.
-      y1[j] = y1[j]-VoltZeroPoint
-      y1[j] = y1[j]*VoltPerDiv/256/1E5
-      x1[j] = x1[j]*TimePerPoint/1E12
-      j = j + 1
-
-  if (j < SampleLength):
-    x1.resize(j)
-    y1.resize(j)
-    
+    VoltPerDivStr=str(VoltPerDiv/1e6)+" V"
+
+  log.log(loglevel,"%s: Number of Samples: %d, Time per division: %s, Volt per division: %s",
+          ch.Name,ch.SampleLength,TimePerDivStr,VoltPerDivStr)
+
+
+def tenmaopen(filename,mmap=True):
+# Open a Tenma .sav file without decoding the samples.
+# Returns a TenmaCapture, see CHANNELS above.
+# With mmap=True opening is near instant whatever the length of the capture
+# and the page cache is shared by every process reading the same file.
+  return(_tenmaparse(_filebuffer(filename,mmap)))
+
+
+def tenmaheader(filename):
+# Parse only the 124 byte main header and the 62 byte channel headers. The
+# file is memory mapped and the sample data is never touched, the channels
+# of the capture have no raw samples.
+  return(_tenmaparse(_filebuffer(filename,True),samples=False))
+
+
+def tenmachunks(filename,channel="CH1",size=1<<20):
+# Yield (x, y) blocks of size samples of one channel of a Tenma .sav file.
+# Invalid 65535 samples are dropped, so a block can be a little shorter.
+  capture=tenmaopen(filename,mmap=True)
+  if capture==-1:
+    return
+  for chunk in capture[channel].chunks(size):
+    yield(chunk)
+
+
+def tenmaread(filename,metadata=False,loglevel=logging.INFO):
+# Returns (x1, y1, x2, y2), or (x1, y1, x2, y2, meta) with metadata=True
+# where meta is the dictionary of header values from Capture.metadata()
+
+  capture=tenmaopen(filename,mmap=False)
+  if capture==-1:
+    return(-1)
+
+  for ch in capture.channels.values():
+    _tenmareport(ch,loglevel)
 
-  if (numChannels == 2):
+  if metadata:
+    return(capture.astuple()+(capture.metadata(),))
+  return(capture.astuple())
+
+
+
+#
+# ANY FORMAT
+#
+
+def _sniff(head):
+# Work out the file type from its first 17 bytes
+  if bytes(head[0:6])==b"SPBV01":
+    return("owon")
+  if bytes(head[0:2])==b"\xaa\x55" and bytes(head[10:17])==b"72-8705":
+    return("tenma")
+  return(None)
+
+
+def read(source,mmap=False):
+# Open a capture from either scope. source is a filename, an open binary
+# file, or the contents of a file already in memory (bytes, bytearray or
+# memoryview, e.g. pulled out of an archive or off a socket). The file is
+# read once and the type worked out from its magic bytes. Returns a
+# TenmaCapture or OwonCapture, which unpacks to the usual tuple:
 #
-# Ch 2
-# header 62 bytes
-# data SampleLength*2 bytes
-   Channel = unpack('B',f.read(1))[0]
-   Coupling = unpack('B',f.read(1))[0]
-   BWLimit = unpack('B',f.read(1))[0]
-   f.seek(8,1)
-   Probe = unpack('B',f.read(1))[0]
-   Invert = unpack('B',f.read(1))[0]
-   VoltZeroPoint = unpack('<H',f.read(2))[0]
-   VoltPerDiv = unpack('<Q',f.read(8))[0]
-   HorPos = unpack('<Q',f.read(8))[0]
-   TimePerDiv = unpack('<Q',f.read(8))[0]
-   TimePerPoint = unpack('<Q',f.read(8))[0]
-   SampleLength = unpack('<L',f.read(4))[0]
-   HorPosPoint = unpack('<L',f.read(4))[0]
-   f.seek(7,1)
-
-#  print(f.tell())
-
-#  print(Channel," ",Coupling," ",BWLimit," ",Probe," ",Invert)
-#  print(VoltZeroPoint," ",VoltPerDiv)
-#  print(HorPos)
-#  print(TimePerDiv," ",TimePerPoint)
-#  print(SampleLength," ",HorPosPoint)
-
-   print("Channel: ",Channel+1)
-   print("Number of Samples: ",SampleLength)
-  
-   if (TimePerDiv < 1e3):
-     print("Time per division: ",TimePerDiv," pS")
-   elif (TimePerDiv < 1e6):
-     print("Time per division: ",TimePerDiv/1e3," nS")
-   elif (TimePerDiv < 1e9):
-     print("Time per division: ",TimePerDiv/1e6," uS")
-   elif (TimePerDiv < 1e12):
-     print("Time per division: ",TimePerDiv/1e9," mS")
-   else:
-     print("Time per division: ",TimePerDiv/1e12, " S")
-     
-   if (VoltPerDiv < 1e3):
-     print("Volt per division: ",VoltPerDiv," uV")
-   elif (VoltPerDiv < 1e6):
-     print("Volt per division: ",VoltPerDiv/1e3," mV")
-   else:
-     print("Volt per division: ",VoltPerDiv/1e6," V")
-
-   x2 = np.empty(SampleLength)
-   y2 = np.empty(SampleLength)
-   j = 0
-   for i in range(SampleLength):
-     value = unpack('<H',f.read(2))[0]
-     if (value != 65535):
-       y2[j] = value
-       x2[j] = i*1.
-       y2[j] = y2[j]-VoltZeroPoint
-       y2[j] = y2[j]*VoltPerDiv/256/1E5
-       x2[j] = x2[j]*TimePerPoint/1E12
-       j = j + 1
-
-   if (j < SampleLength):
-     x2.resize(j)
-     y2.resize(j)
-
-#  print(f.tell(),FileSize-f.tell())
+#   x1,y1,x2,y2=read("week3_3.sav")
+
+  if isinstance(source,(bytes,bytearray)):
+    buf=source
+  elif isinstance(source,memoryview):
+    buf=source.cast('B')
+  elif hasattr(source,'read'):
+    buf=source.read()
   else:
-   x2 = x1
-   if (Channel == 1):
-    y2 = y1
-    y1 = np.zeros(len(x1))
-   else:
-    y2 = np.zeros(len(x2)) 
+    buf=_filebuffer(source,mmap)
 
-# TRAILER (8 bytes)
-# all 15
+  Format=_sniff(buf[0:17])
+  if Format=="tenma":
+    return(_tenmaparse(buf))
+  if Format=="owon":
+    return(_owonparse(buf))
+  log.warning("wrong data file type")
+  return(-1)
+
+
+#
+# CATALOG
+#
+# A SQLite index of the headers of every capture below a directory, so
+# files can be picked by timebase, V/div, sample length or serial number
+# without decoding them. Times are in seconds, voltages in volts and Probe
+# is the attenuation factor for both scope types.
+#
+#   catalogupdate("Week 4","captures.db")
+#   catalogfind("captures.db",TimePerDiv=1e-3,Samples=6000)
+
+TenmaProbe={0:1,1:10,4:100,3:1000}
+
+CatalogSchema='''
+CREATE TABLE IF NOT EXISTS captures (
+  Path TEXT PRIMARY KEY, Size INTEGER, MTime REAL, Format TEXT,
+  Model TEXT, Serial TEXT, TriggerLevel REAL);
+CREATE TABLE IF NOT EXISTS channels (
+  Path TEXT, Name TEXT, Samples INTEGER, TimePerDiv REAL, VoltPerDiv REAL,
+  TimePerPoint REAL, Probe INTEGER, PRIMARY KEY (Path, Name));
+'''
+
+
+def _catalogrows(path,head):
+  Format=_sniff(head)
+  if Format=="tenma":
+    capture=tenmaheader(path)
+    row=(Format,capture.Model,capture.Serial,capture.TriggerLevel/1E6)
+    channels=[(ch.Name,ch.SampleLength,ch.TimePerDiv/1E12,ch.VoltPerDiv/1E6,
+               ch.TimePerPoint/1E12,TenmaProbe.get(ch.Probe))
+              for ch in capture.channels.values()]
+  elif Format=="owon":
+    capture=owonheader(path)
+    row=(Format,capture.Model,None,None)
+    channels=[(ch.Name,ch.NumSamples,ch.TimePerDiv,ch.VoltPerDiv,
+               ch.SperSample,ch.ProbeAttn)
+              for ch in capture.channels.values()]
+  else:
+    return(None)
+  return(row,channels)
+
+
+def catalogupdate(root,database="captures.db",patterns=("*.sav","*.bin")):
+# Add the headers of every capture below root to the catalog. Files whose
+# size and mtime are unchanged since the last update are not opened again
+# and files that have gone are dropped. Returns (updated, removed).
+
+  import fnmatch
+  import os
+  import sqlite3
+
+  db=sqlite3.connect(database)
+  db.executescript(CatalogSchema)
+  root=os.path.abspath(root)
+  known={}
+  prefix=os.path.join(root,"")
+  # an exact prefix, LIKE would take _ and % as wildcards and ignore case
+  for Path,Size,MTime in db.execute(
+      "SELECT Path, Size, MTime FROM captures WHERE substr(Path,1,?)=?",
+      (len(prefix),prefix)):
+    known[Path]=(Size,MTime)
+
+  updated=0
+  for dirpath,dirnames,filenames in os.walk(root):
+    for name in filenames:
+      if not any(fnmatch.fnmatch(name,p) for p in patterns):
+        continue
+      path=os.path.join(dirpath,name)
+      st=os.stat(path)
+      if known.pop(path,None)==(st.st_size,st.st_mtime):
+        continue
+      f=open(path,'rb')
+      head=f.read(17)
+      f.close()
+      try:
+        rows=_catalogrows(path,head)
+      except (ValueError,IndexError,error):   # truncated or corrupt header
+        rows=None
+      db.execute("DELETE FROM channels WHERE Path=?",(path,))
+      db.execute("DELETE FROM captures WHERE Path=?",(path,))
+      if rows is None:
+        continue
+      row,channels=rows
+      db.execute("INSERT INTO captures VALUES (?,?,?,?,?,?,?)",
+                 (path,st.st_size,st.st_mtime)+row)
+      db.executemany("INSERT INTO channels VALUES (?,?,?,?,?,?,?)",
+                     [(path,)+ch for ch in channels])
+      updated=updated+1
+
+  for path in known:
+    db.execute("DELETE FROM channels WHERE Path=?",(path,))
+    db.execute("DELETE FROM captures WHERE Path=?",(path,))
+
+  db.commit()
+  db.close()
+  return(updated,len(known))
+
+
+def catalogfind(database="captures.db",**criteria):
+# Returns a list of (Path, Name) for the channels matching every keyword,
+# e.g. catalogfind(db,Serial="0134613003",VoltPerDiv=0.5). Floats are
+# compared to one part in 1E6 (the long timebases are stored slightly off).
+
+  import sqlite3
+
+  columns=("Path","Size","MTime","Format","Model","Serial","TriggerLevel",
+           "Name","Samples","TimePerDiv","VoltPerDiv","TimePerPoint","Probe")
+  where=[]
+  values=[]
+  for key,value in sorted(criteria.items()):
+    if key not in columns:
+      raise ValueError("unknown catalog column: "+key)
+    column=("channels." if key in ("Path","Name") else "")+key
+    if isinstance(value,float):
+      where.append("abs("+column+"-?)<=1E-6*abs(?)")
+      values.extend([value,value])
+    else:
+      where.append(column+"=?")
+      values.append(value)
+
+  query="SELECT channels.Path, Name FROM channels JOIN captures USING (Path)"
+  if where:
+    query=query+" WHERE "+" AND ".join(where)
+  query=query+" ORDER BY channels.Path, Name"
+
+  db=sqlite3.connect(database)
+  rows=db.execute(query,values).fetchall()
+  db.close()
+  return(rows)
+
+
+#
+# BATCH
+#
+
+def _readone(reader,filename):
+  try:
+    return(reader(filename))
+  except Exception as e:   # handed back as the result for that file
+    return(e)
+
+
+def readmany(files,reader=None,workers=None,processes=False):
+# Read a list of files (or a glob pattern such as "Week 4/*.sav") with
+# reader, tenmaread by default, in a pool of workers. Decoding is done by
+# numpy so threads are used unless processes=True. Returns a dictionary of
+# filename to result in the order the files were given; a file that fails
+# gives the exception instead of stopping the batch.
 
-  TrailerSize = 8
-  for i in range(TrailerSize):
-    j = f.tell()
-    byte = f.read(1)
-#    print(j,i,unpack('c',byte)[0],unpack('B',byte)[0])
-    head[j] = unpack('B',byte)[0]
+  import concurrent.futures
+  import glob
 
-  return(x1,y1,x2,y2)
+  if reader is None:
+    reader=tenmaread
+  if isinstance(files,str):
+    files=sorted(glob.glob(files))
+  else:
+    files=list(files)
+
+  if processes:
+    pool=concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+  else:
+    pool=concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+  with pool:
+    results=list(pool.map(_readone,[reader]*len(files),files))
+
+  return(dict(zip(files,results)))
+
+
+#
+# CACHE
+#
+
+class ReadCache(object):
+# Keeps what a reader returned for each file in directory, so running an
+# analysis script again only has to load the results back.
+#
+#   cache=ReadCache("physlab_cache",maxbytes=2**30)
+#   x1,y1,x2,y2=cache.read("week3_3.sav")             # tenmaread
+#   x1,y1,x2,y2=cache.read("trace.bin",owonread)
+#   fit=cache.read("week4_1.sav",fitrun)              # any reader
+#
+# For tenmaread, owonread and read the entry is the capture itself, the raw
+# codes and header values, about the size of the file, and the volts and
+# times are worked out again on a hit. Decoding is already about as quick
+# as loading that back, so the cache only really pays off for readers that
+# do more than decode, e.g. filtering or fitting. An entry is found by the
+# path, size and mtime of the file plus the reader used. Once the cache
+# grows past maxbytes the least recently used entries are removed. hits
+# and misses count lookups.
+
+  __slots__=('directory','maxbytes','hits','misses')
+
+  def __init__(self,directory="physlab_cache",maxbytes=2**30):
+    import os
+    self.directory=directory
+    self.maxbytes=maxbytes
+    self.hits=0
+    self.misses=0
+    os.makedirs(directory,exist_ok=True)
+
+  def key(self,filename,reader):
+    import hashlib
+    import os
+    st=os.stat(filename)
+    h=hashlib.blake2b(digest_size=20)
+    h.update(repr((os.path.abspath(filename),st.st_size,st.st_mtime_ns,
+                   reader.__module__,reader.__qualname__)).encode())
+    return(h.hexdigest())
+
+  def read(self,filename,reader=None):
+    import os
+    import pickle
+    import threading
+    if reader is None:
+      reader=tenmaread
+    # the decoders are cached as the undecoded capture
+    opener={tenmaread:tenmaopen,owonread:owonopen,read:read}.get(reader)
+    path=os.path.join(self.directory,self.key(filename,reader)+".pkl")
+    try:
+      f=open(path,'rb')
+      try:
+        result=pickle.load(f)
+      finally:
+        f.close()
+    except (OSError,EOFError,pickle.UnpicklingError):   # not there yet, or half written
+      self.misses=self.misses+1
+    else:
+      self.hits=self.hits+1
+      os.utime(path)
+      if opener is not None and reader is not read:
+        return(result.astuple())
+      return(result)
+
+    if opener is not None:
+      result=opener(filename,mmap=False)
+    else:
+      result=reader(filename)
+    if isinstance(result,int) and result==-1:
+      return(result)
+    tmp=path+"."+str(os.getpid())+"."+str(threading.get_ident())+".tmp"
+    f=open(tmp,'wb')
+    pickle.dump(result,f,protocol=pickle.HIGHEST_PROTOCOL)
+    f.close()
+    os.replace(tmp,path)
+    self.evict()
+    if opener is not None and reader is not read:
+      return(result.astuple())
+    return(result)
+
+  def evict(self):
+# Remove least recently used entries until the cache fits in maxbytes
+    import os
+    entries=[]
+    for e in os.scandir(self.directory):
+      if e.name.endswith((".pkl",".npz")):   # .npz from older versions
+        st=e.stat()
+        entries.append((st.st_mtime,st.st_size,e.path))
+    entries.sort()
+    total=sum(size for mtime,size,path in entries)
+    for mtime,size,path in entries:
+      if total<=self.maxbytes:
+        break
+      try:
+        os.remove(path)
+      except FileNotFoundError:   # removed by another process
+        pass
+      total=total-size
+
+  def clear(self):
+    import os
+    for e in os.scandir(self.directory):
+      if e.name.endswith((".pkl",".npz")):
+        os.remove(e.path)
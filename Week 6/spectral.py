@@ -0,0 +1,409 @@
+#
+# Amplitude spectra of many signals at once. Signals of the same length
+# and sample spacing are stacked into one 2-D array and transformed in a
+# single multithreaded scipy.fft call; a ragged list is grouped by length
+# first. The amplitude is |FT| * 2 / N of the signal less its mean, as in
+# fourierSeries.py, and the frequencies come from rfftfreq so they are
+# exact for odd and even lengths.
+#
+#   freqs, ft = amplitudeSpectrum(np.stack(signals), t[1] - t[0])
+#   for freqs, ft in amplitudeSpectra(signals, dt): ...
+#
+
+from collections import OrderedDict
+
+import numpy as np
+import scipy.fft
+from scipy.fft import next_fast_len
+from scipy.signal import get_window, lfilter, zoom_fft
+
+def amplitudeSpectrum(y, dt, workers = -1):
+    # y is one signal or a 2-D array with one signal per row
+    y = np.asarray(y, dtype = float)
+    n = y.shape[-1]
+    ft = scipy.fft.rfft(y - np.mean(y, axis = -1, keepdims = True), axis = -1, workers = workers)
+    return scipy.fft.rfftfreq(n, dt), np.abs(ft) * 2. / n
+
+def amplitudeSpectra(signals, dt, workers = -1):
+    # signals is a list of 1-D arrays, dt one spacing or one per signal;
+    # returns a list of (freqs, ft) in the same order
+    dts = np.broadcast_to(np.asarray(dt, dtype = float), (len(signals),))
+    groups = {}
+    for k, y in enumerate(signals):
+        groups.setdefault((len(y), dts[k]), []).append(k)
+    result = [None] * len(signals)
+    for (n, step), members in groups.items():
+        freqs, ft = amplitudeSpectrum(np.stack([signals[k] for k in members]), step, workers)
+        for row, k in enumerate(members):
+            result[k] = (freqs, ft[row])
+    return result
+
+#
+# The frequency of the strongest peak to a small fraction of a bin. The
+# peak bin of a windowed FFT is refined by interpolating between it and
+# its neighbours, optionally followed by a zoom FFT (chirp-z) over the
+# bins either side of it, instead of zero padding the whole signal, and
+# then polished by a least squares fit of a single sine:
+#
+#   f, amplitude, phase, error = peakFrequency(y, t[1] - t[0])
+#
+# method is "quinn" (Quinn's second estimator on the complex spectrum with
+# no window, the default, so the peak is that of the plain |FT|),
+# "parabolic" (on the magnitudes) or "gaussian" (parabolic on the log
+# magnitudes, with the Hann window unless another is given). The fit takes
+# out the bias these leave, up to a few percent of a bin, so f, amplitude
+# and phase are those of the fitted sine and error is its standard error
+# from the fit, close to the Cramer-Rao bound. iterations limits the
+# Gauss-Newton steps of the fit. The error assumes one sine in white noise
+# and means nothing for, say, broadband noise with no dominant tone.
+#
+
+def _quinnTau(x):
+    return (np.log(3 * x**2 + 6 * x + 1) / 4 -
+            np.sqrt(6) / 24 * np.log((x + 1 - np.sqrt(2 / 3.)) / (x + 1 + np.sqrt(2 / 3.))))
+
+def _rotations(omega, n):
+    # exp(i omega s) for s = k - (n - 1) / 2, from an outer product of two
+    # short runs of exponentials instead of n sines and cosines
+    block = int(np.sqrt(n)) + 1
+    s0 = -(n - 1) / 2.
+    z = np.outer(np.exp(1j * omega * (s0 + block * np.arange(block))), np.exp(1j * omega * np.arange(block)))
+    return z.ravel()[:n]
+
+def _sineFit(y, omega, iterations):
+    # Gauss-Newton on y = A cos(omega s) + B sin(omega s) + C, s centred on
+    # the middle sample, with A, B and C solved exactly at each omega. One
+    # step is usually enough from the interpolated peak.
+    # Returns omega, A, B and the variance of omega.
+    n = len(y)
+    s = np.arange(n) - (n - 1) / 2.
+    start = omega
+    sy = np.sum(y)
+    yy = y @ y
+    for i in range(max(iterations, 1)):
+        z = _rotations(omega, n)
+        c = np.ascontiguousarray(z.real)
+        si = np.ascontiguousarray(z.imag)
+        sc = np.sum(c)
+        ss = np.sum(si)
+        M = np.array([[c @ c, c @ si, sc], [c @ si, si @ si, ss], [sc, ss, n]])
+        cy = c @ y
+        siy = si @ y
+        A, B, C = np.linalg.solve(M, [cy, siy, sy])
+        d = np.multiply(c, B)
+        d -= np.multiply(si, A)
+        d *= s
+        dc = d @ c
+        dsi = d @ si
+        sd = np.sum(d)
+        JTJ = np.empty((4, 4))
+        JTJ[:3, :3] = M
+        JTJ[3, :3] = JTJ[:3, 3] = [dc, dsi, sd]
+        JTJ[3, 3] = d @ d
+        inverse = np.linalg.inv(JTJ)
+        # the residual r = y - A c - B si - C is never formed: at the best
+        # A, B and C it is orthogonal to c, si and 1, so only d @ r counts
+        rss = max(yy - A * cy - B * siy - C * sy, 0.)
+        variance = inverse[3, 3] * rss / (n - 4)
+        step = inverse[3, 3] * (d @ y - A * dc - B * dsi - C * sd)
+        if abs(omega + step - start) > 2 * np.pi / n:   # wandered off the peak
+            break
+        # the last step is taken without going round again, A, B and the
+        # variance hardly change over a step of the order of the error
+        omega += step
+        if step**2 < variance:
+            break
+    return omega, A, B, variance
+
+def peakFrequency(y, dt, method = "quinn", window = None, zoom = False, zoomPoints = 64, iterations = 3):
+    y = np.asarray(y, dtype = float)
+    y = y - np.mean(y)
+    n = len(y)
+    if method == "quinn":
+        window = "boxcar"
+    elif window is None:
+        window = "hann"
+    w = get_window(window, n)
+    ft = scipy.fft.rfft(y * w)
+    mag = np.abs(ft)
+    k = 1 + np.argmax(mag[1:-1])   # not DC, and with a bin either side
+
+    if method == "parabolic" or method == "gaussian":
+        a, b, c = mag[k - 1:k + 2]
+        if method == "gaussian":
+            a, b, c = np.log(np.maximum([a, b, c], np.finfo(float).tiny))
+        delta = 0.5 * (a - c) / (a - 2 * b + c)
+    elif method == "quinn":
+        ap = (ft[k + 1] / ft[k]).real
+        am = (ft[k - 1] / ft[k]).real
+        dp = -ap / (1 - ap)
+        dm = am / (1 - am)
+        delta = (dp + dm) / 2 + _quinnTau(dp**2) - _quinnTau(dm**2)
+    else:
+        raise ValueError("unknown method: " + str(method))
+    f = (k + delta) / (n * dt)
+
+    if zoom:
+        # the windowed spectrum on a fine grid one bin either side of f
+        fs = 1 / dt
+        grid = np.linspace(f - fs / n, f + fs / n, zoomPoints)
+        fine = np.abs(zoom_fft(y * w, [grid[0], grid[-1]], zoomPoints, fs = fs, endpoint = True))
+        j = min(max(np.argmax(fine), 1), zoomPoints - 2)
+        a, b, c = fine[j - 1:j + 2]
+        f = grid[j] + 0.5 * (a - c) / (a - 2 * b + c) * (grid[1] - grid[0])
+
+    # a least squares fit of a sine plus an offset, started from f, takes
+    # out the bias left by the interpolation and the leakage from negative
+    # frequencies, and gives the error from its own covariance
+    omega, A, B, cov = _sineFit(y, 2 * np.pi * f * dt, iterations)
+    f = omega / (2 * np.pi * dt)
+    amplitude = np.hypot(A, B)
+    phase = np.angle(np.exp(1j * (np.arctan2(-B, A) - omega * (n - 1) / 2.)))
+    error = np.sqrt(cov) / (2 * np.pi * dt)
+    return f, amplitude, phase, error
+
+#
+# Welch power spectra and spectrograms of captures too long to transform
+# in one go. Blocks of samples are added as they are read, the last
+# segment - hop samples of each block are carried over to the next, and
+# each full segment is windowed, transformed and either averaged into the
+# power spectral density or written out as one column of a spectrogram in
+# a file, so memory is bounded by the block and segment sizes and not by
+# the length of the capture:
+#
+#   welch = WelchAccumulator(dt, segment = 4096, spectrogram = "spec.dat")
+#   for x, y in tenmachunks("save1.sav", "CH1"):
+#       welch.add(y)
+#   freqs, psd = welch.psd()          # V^2/Hz, as scipy.signal.welch
+#   spec = welch.spectrogram()        # memmap, one row per segment
+#   times = welch.times()             # centre of each row, from t = 0
+#
+# or welch = welchChunks(tenmachunks("save1.sav"), segment = 4096).
+#
+
+class WelchAccumulator:
+
+    __slots__ = ('dt', 'segment', 'hop', 'window', 'scale', 'tail', 'total',
+                 'count', 'filename', 'file')
+
+    def __init__(self, dt, segment = 4096, overlap = 0.5, window = "hann", spectrogram = None):
+        self.dt = dt
+        self.segment = segment
+        self.hop = segment - int(segment * overlap)
+        if self.hop < 1:
+            raise ValueError("overlap must be less than 1")
+        self.window = get_window(window, segment)
+        # one-sided density, the DC and Nyquist bins are not doubled
+        self.scale = np.full(segment // 2 + 1, 2 * dt / np.sum(self.window**2))
+        self.scale[0] /= 2
+        if segment % 2 == 0:
+            self.scale[-1] /= 2
+        self.tail = np.zeros(0)
+        self.total = np.zeros(segment // 2 + 1)
+        self.count = 0
+        self.filename = spectrogram
+        self.file = open(spectrogram, 'wb') if spectrogram is not None else None
+
+    def add(self, y):
+        y = np.concatenate([self.tail, np.asarray(y, dtype = float)])
+        if len(y) < self.segment:
+            self.tail = y
+            return self
+        segments = np.lib.stride_tricks.sliding_window_view(y, self.segment)[::self.hop]
+        segments = segments - np.mean(segments, axis = 1, keepdims = True)
+        power = np.abs(scipy.fft.rfft(segments * self.window, axis = 1, workers = -1))**2 * self.scale
+        self.total += np.sum(power, axis = 0)
+        self.count += len(power)
+        if self.file is not None:
+            power.tofile(self.file)
+        self.tail = y[len(power) * self.hop:].copy()
+        return self
+
+    def frequencies(self):
+        return scipy.fft.rfftfreq(self.segment, self.dt)
+
+    def psd(self):
+        if self.count == 0:
+            raise ValueError("fewer samples than one segment")
+        return self.frequencies(), self.total / self.count
+
+    def times(self):
+        return (np.arange(self.count) * self.hop + self.segment / 2.) * self.dt
+
+    def spectrogram(self):
+        if self.file is None:
+            raise ValueError("no spectrogram file was given")
+        self.file.flush()
+        return np.memmap(self.filename, dtype = float, mode = 'r',
+                         shape = (self.count, self.segment // 2 + 1))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+def welchChunks(chunks, segment = 4096, overlap = 0.5, window = "hann", spectrogram = None):
+    # chunks is an iterable of (x, y) blocks, as from Channel.chunks or
+    # tenmachunks; the sample spacing is taken from the first block
+    welch = None
+    for x, y in chunks:
+        if welch is None:
+            welch = WelchAccumulator(x[1] - x[0], segment, overlap, window, spectrogram)
+        welch.add(y)
+    if welch is not None and welch.file is not None:
+        welch.file.flush()
+    return welch
+
+#
+# The amplitude and phase at a few chosen frequencies, such as a
+# fundamental and its harmonics, without a full FFT. Each frequency is one
+# DFT bin, at any frequency and not only at bin centres, worked out by the
+# Goertzel recurrence run by lfilter, so the cost is one pass over the
+# samples per frequency and no memory beyond the filter output. The
+# amplitude is 2 |X| / N of the signal less its mean, as amplitudeSpectrum,
+# and the phase is that of a cosine at t = 0:
+#
+#   amplitude, phase = toneAmplitudes(np.stack(signals), dt, [f0, 2 * f0, 3 * f0])
+#
+# ToneDetector does the same for blocks of samples as they arrive by
+# carrying the filter state from one block to the next, giving the same
+# result as toneAmplitudes on the whole record:
+#
+#   tones = ToneDetector([f0, 2 * f0], dt)
+#   for x, y in tenmachunks("save1.sav"):
+#       tones.add(y)
+#   amplitude, phase = tones.amplitudes()
+#   tones.reset()                      # start the next measurement
+#
+
+def _goertzel(y, omega, zi):
+    # the final state of s[m] = y[m] + 2 cos(omega) s[m-1] - s[m-2]
+    return lfilter([1.], [1., -2 * np.cos(omega), 1.], y, axis = -1, zi = zi)[1]
+
+def _goertzelValue(zf, omega, n):
+    # sum of y[m] exp(-i omega m) over the n samples from the final state;
+    # the state of lfilter is (2 cos(omega) s[n-1] - s[n-2], -s[n-1])
+    s1 = -zf[..., 1]
+    s2 = 2 * np.cos(omega) * s1 - zf[..., 0]
+    return np.exp(-1j * omega * (n - 1)) * (s1 - np.exp(-1j * omega) * s2)
+
+def _onesValue(omega, n):
+    # sum of exp(-i omega m) over n samples, to take the mean out afterwards
+    z = np.exp(-1j * omega)
+    if abs(1 - z) < 1e-12:
+        return complex(n)
+    return (1 - z**n) / (1 - z)
+
+def _toneValues(states, omegas, n, total):
+    X = np.stack([_goertzelValue(zf, omega, n) - total / n * _onesValue(omega, n)
+                  for zf, omega in zip(states, omegas)], axis = -1)
+    return np.abs(X) * 2. / n, np.angle(X)
+
+def toneAmplitudes(y, dt, freqs):
+    # y is one signal or a 2-D array with one signal per row; the result
+    # has one column per frequency
+    y = np.asarray(y, dtype = float)
+    omegas = 2 * np.pi * np.atleast_1d(freqs) * dt
+    zi = np.zeros(y.shape[:-1] + (2,))
+    states = [_goertzel(y, omega, zi) for omega in omegas]
+    return _toneValues(states, omegas, y.shape[-1], np.sum(y, axis = -1))
+
+class ToneDetector:
+
+    __slots__ = ('omegas', 'n', 'states', 'total')
+
+    def __init__(self, freqs, dt):
+        self.omegas = 2 * np.pi * np.atleast_1d(np.asarray(freqs, dtype = float)) * dt
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.states = None
+        self.total = 0.
+        return self
+
+    def add(self, y):
+        # y is a block of one signal, or of several as rows
+        y = np.asarray(y, dtype = float)
+        if self.states is None:
+            self.states = [np.zeros(y.shape[:-1] + (2,)) for omega in self.omegas]
+        self.states = [_goertzel(y, omega, zi) for omega, zi in zip(self.omegas, self.states)]
+        self.total = self.total + np.sum(y, axis = -1)
+        self.n += y.shape[-1]
+        return self
+
+    def amplitudes(self):
+        if self.n == 0:
+            raise ValueError("no samples have been added")
+        return _toneValues(self.states, self.omegas, self.n, self.total)
+
+#
+# Repeated spectra of captures of the same length, such as every Tenma
+# file at one timebase, without redoing the set up each time. A context
+# keeps, for each shape, window and sample spacing, the window, the
+# frequency grid, a zero padded input buffer of next_fast_len points and
+# the output array, so each call is only the transform. The least recently
+# used of more than maxsize plans are dropped. The returned spectrum is the
+# context's own array and is overwritten by the next call with the same
+# shape, so copy it if it is kept:
+#
+#   context = SpectralContext()
+#   for name in files:
+#       t, y, x2, y2 = tenmaread(name)
+#       freqs, ft = context.amplitudeSpectrum(y, t[1] - t[0], "hann")
+#
+# The amplitude is 2 |FT| / sum(window) of the signal less its mean, which
+# is amplitudeSpectrum for the default boxcar window with pad = False.
+#
+
+class _SpectralPlan:
+
+    __slots__ = ('nfft', 'window', 'gain', 'freqs', 'buffer', 'amplitude')
+
+    def __init__(self, shape, window, dt, pad):
+        n = shape[-1]
+        self.nfft = next_fast_len(n, real = True) if pad else n
+        self.window = get_window(window, n)
+        self.gain = 2. / np.sum(self.window)
+        self.freqs = scipy.fft.rfftfreq(self.nfft, dt)
+        self.buffer = np.zeros(shape[:-1] + (self.nfft,))
+        self.amplitude = np.empty(shape[:-1] + (self.nfft // 2 + 1,))
+
+class SpectralContext:
+
+    __slots__ = ('maxsize', 'workers', 'plans', 'hits', 'misses')
+
+    def __init__(self, maxsize = 16, workers = -1):
+        self.maxsize = maxsize
+        self.workers = workers
+        self.plans = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def plan(self, shape, dt, window = "boxcar", pad = True):
+        key = (tuple(shape), window, float(dt), pad)
+        plan = self.plans.get(key)
+        if plan is not None:
+            self.hits += 1
+            self.plans.move_to_end(key)
+            return plan
+        self.misses += 1
+        plan = self.plans[key] = _SpectralPlan(tuple(shape), window, dt, pad)
+        while len(self.plans) > self.maxsize:
+            self.plans.popitem(last = False)
+        return plan
+
+    def amplitudeSpectrum(self, y, dt, window = "boxcar", pad = True):
+        # y is one signal or a 2-D array with one signal per row
+        y = np.asarray(y, dtype = float)
+        plan = self.plan(y.shape, dt, window, pad)
+        n = y.shape[-1]
+        data = plan.buffer[..., :n]
+        np.subtract(y, np.mean(y, axis = -1, keepdims = True), out = data)
+        data *= plan.window
+        ft = scipy.fft.rfft(plan.buffer, axis = -1, workers = self.workers)
+        np.abs(ft, out = plan.amplitude)
+        plan.amplitude *= plan.gain
+        return plan.freqs, plan.amplitude
+
+    def clear(self):
+        self.plans.clear()